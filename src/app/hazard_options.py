@@ -2,30 +2,103 @@
 This module contains a function to generate menu options for a user interface.
 """
 
+import functools
 import itertools
 import json
 import logging
+import os
 import re
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import boto3
+from botocore import UNSIGNED
+from botocore.config import Config
 from botocore.exceptions import ClientError, NoCredentialsError
 from s3pathlib import S3Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
 # Set up logging
 logging.basicConfig(level=logging.CRITICAL)
 logger = logging.getLogger(__name__)
 
+# Splits CamelCase hazard types into separate words
+_CAMEL_RE = re.compile(r"(?<!^)(?=[A-Z])")
+
+# Formatted scenario labels, keyed by scenario id
+_scenario_label_cache: dict[str, str] = {}
+
+# Maximum number of item files downloaded concurrently
+MAX_DOWNLOAD_WORKERS = 32
+
+# Setting HAZARD_OPTIONS_CACHE_DIR keeps downloaded files on disk in that directory
+# between runs, reusing them while their ETag matches. The cache is off by default.
+CACHE_DIR_ENV = "HAZARD_OPTIONS_CACHE_DIR"
+_disk_cache = None
+_disk_cache_opened = False
+_disk_cache_lock = threading.Lock()
+# Errors from the disk cache, which are logged and then ignored as it is optional
+_DISK_CACHE_ERRORS = (OSError, sqlite3.Error) + (
+    (diskcache.Timeout,) if diskcache is not None else ()
+)
+
+# Shared anonymous S3 client, boto3 clients are thread-safe so this is reused by all
+# downloads. The connection pool is sized to cover the concurrent download workers.
+_S3 = boto3.client(
+    "s3",
+    config=Config(
+        signature_version=UNSIGNED,
+        max_pool_connections=2 * MAX_DOWNLOAD_WORKERS,
+        retries={"max_attempts": 3},
+    ),
+)
+
+
+def _get_disk_cache():
+    """
+    Opens the on-disk download cache the first time it is needed, if a cache
+    directory has been set.
 
-def download_from_s3(s3_url: str) -> dict:
+    Returns:
+    diskcache.Cache: The cache, or None if it is not enabled or can't be opened.
+    """
+    global _disk_cache, _disk_cache_opened
+    with _disk_cache_lock:
+        if not _disk_cache_opened:
+            _disk_cache_opened = True
+            cache_dir = os.environ.get(CACHE_DIR_ENV)
+            if diskcache is not None and cache_dir:
+                try:
+                    _disk_cache = diskcache.Cache(os.path.expanduser(cache_dir))
+                except _DISK_CACHE_ERRORS as e:
+                    logger.warning("Unable to open cache in %s: %s", cache_dir, e)
+        return _disk_cache
+
+
+@functools.lru_cache(maxsize=4096)
+def _get_object_bytes(s3_url: str) -> bytes:
     """
-    Downloads a file from S3 and returns its content as a dictionary.
+    Downloads a file from S3 and returns its raw content. Results are cached by URL
+    in memory and, when the disk cache is enabled, on disk where a cached copy is
+    revalidated with a conditional request and reused while its ETag matches the
+    object in S3. Errors are raised and not cached.
 
     Parameters:
     s3_url (str): The S3 URL of the file to download.
 
     Returns:
-    dict: The content of the file as a dictionary.
+    bytes: The content of the file.
     """
     logger.debug("Downloading from S3: %s", s3_url)
     # Parse the S3 URL
@@ -34,22 +107,59 @@ def download_from_s3(s3_url: str) -> dict:
 
     logger.debug("Bucket: %s, Key: %s", s3_bucket, s3_key)
 
-    # Create an S3 client
-    s3 = boto3.client("s3", aws_access_key_id="", aws_secret_access_key="")
-    s3._request_signer.sign = lambda *args, **kwargs: None
+    disk_cache = _get_disk_cache()
+    cached = None
+    if disk_cache is not None:
+        try:
+            cached = disk_cache.get(s3_url)
+        except _DISK_CACHE_ERRORS as e:
+            logger.warning("Unable to read %s from cache: %s", s3_url, e)
+    if cached is None:
+        obj = _S3.get_object(Bucket=s3_bucket, Key=s3_key)
+    else:
+        # Only download the object again if it has changed since it was cached
+        try:
+            obj = _S3.get_object(Bucket=s3_bucket, Key=s3_key, IfNoneMatch=cached[0])
+        except ClientError as e:
+            if e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") != 304:
+                raise
+            logger.debug("Using cached copy of %s", s3_url)
+            return cached[1]
+    data = obj["Body"].read()
+    if disk_cache is not None:
+        try:
+            disk_cache.set(s3_url, (obj["ETag"], data))
+        except _DISK_CACHE_ERRORS as e:
+            logger.warning("Unable to write %s to cache: %s", s3_url, e)
+    return data
+
+
+def download_from_s3(s3_url: str) -> dict:
+    """
+    Downloads a file from S3 and returns its content as a dictionary. The raw file
+    content is cached, so each call returns a newly parsed dictionary.
+
+    Parameters:
+    s3_url (str): The S3 URL of the file to download.
 
+    Returns:
+    dict: The content of the file as a dictionary.
+    """
     try:
-        obj = s3.get_object(Bucket=s3_bucket, Key=s3_key)
-        data = obj["Body"].read()
-        # parse json object
-        data = json.loads(data)
-        return data
+        data = _get_object_bytes(s3_url)
     except NoCredentialsError:
         print("Credentials not available")
         return False
     except ClientError as e:
         print(f"Error downloading from S3: {e}")
         return False
+    # parse json object, orjson rejects NaN and Infinity so those go through json
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
 
 
 def get_item_links(catalog_url: str) -> list[str]:
@@ -64,11 +174,24 @@ def get_item_links(catalog_url: str) -> list[str]:
     """
     catalog_data = download_from_s3(catalog_url)
     base_url = S3Path(catalog_url).parent
-    items = [
-        (base_url / Path(link["href"]).as_posix()).uri
-        for link in catalog_data["links"]
-        if link["rel"] == "item"
-    ]
+    prefix = base_url.uri.rstrip("/") + "/"
+    items = []
+    for link in catalog_data["links"]:
+        if link["rel"] != "item":
+            continue
+        href = link["href"].removeprefix("./")
+        # Hrefs that are already normalised can be joined directly, anything with
+        # empty or "." segments, or a leading or trailing slash, goes through S3Path
+        if (
+            href in ("", ".")
+            or href.startswith(("/", "./"))
+            or href.endswith(("/", "/."))
+            or "//" in href
+            or "/./" in href
+        ):
+            items.append((base_url / Path(link["href"]).as_posix()).uri)
+        else:
+            items.append(prefix + href)
     return items
 
 
@@ -84,7 +207,7 @@ def get_hazard_types(data: dict) -> list[dict]:
     """
     hazard_type = data["properties"]["osc-hazard:hazard_type"]
     hazard_type_list = [
-        {"label": re.sub(r"(?<!^)(?=[A-Z])", " ", hazard_type), "value": hazard_type}
+        {"label": _CAMEL_RE.sub(" ", hazard_type), "value": hazard_type}
     ]
     return dedupe_dict(hazard_type_list)
 
@@ -117,12 +240,15 @@ def get_scenario_options(scenarios: dict) -> list[dict]:
     """
     scenario_options = []
     for scene in scenarios:
-        if scene["id"].startswith("ssp") and len(scene["id"]) == 6:
-            formatted_id = f"SSP{scene['id'][3]}-{scene['id'][4]}.{scene['id'][5:]}"
-        elif scene["id"].startswith("rcp"):
-            formatted_id = f"RCP-{(scene['id'][3:]).replace('p', '.')}"
-        else:
-            formatted_id = scene["id"]
+        formatted_id = _scenario_label_cache.get(scene["id"])
+        if formatted_id is None:
+            if scene["id"].startswith("ssp") and len(scene["id"]) == 6:
+                formatted_id = f"SSP{scene['id'][3]}-{scene['id'][4]}.{scene['id'][5:]}"
+            elif scene["id"].startswith("rcp"):
+                formatted_id = f"RCP-{(scene['id'][3:]).replace('p', '.')}"
+            else:
+                formatted_id = scene["id"]
+            _scenario_label_cache[scene["id"]] = formatted_id
         scenario_options.append(
             {
                 "label": formatted_id,
@@ -148,45 +274,45 @@ def get_indicator_options(data: dict) -> list[dict]:
     Returns:
     list[dict]: A list of dictionaries containing indicator options.
     """
-    params = data["properties"]["osc-hazard:params"]
-    indicator_options = []
-    param_values = list(itertools.product(*params.values()))
-    for values in param_values:
-        props = data["properties"]
-        param_dict = dict(zip(params.keys(), values))
-        # Checks if there are keys in param_dict
-        if not param_dict:
-            display_name = props["osc-hazard:display_name"]
-            path = data["properties"]["osc-hazard:path"]
-        # Check if all keys are in the strings
-        for key in param_dict.keys():
-            if key not in props["osc-hazard:indicator_id"]:
-                display_name = (
-                    props["osc-hazard:display_name"]
-                    .replace("{" + key + "}", "")
-                    .format(**param_dict)
-                )
-            else:
-                display_name = props["osc-hazard:display_name"].format(**param_dict)
-            path = (data["properties"]["osc-hazard:path"]).format_map(
-                CustomDict(**param_dict)
-            )
-        indicator_id = (
-            props["osc-hazard:indicator_id"].replace("/", "_").format(**param_dict)
-        )
-        if props['osc-hazard:indicator_model_id']:
-            indicator_id = indicator_id + "_" + props['osc-hazard:indicator_model_id'].replace("/", "_")
-        
-        if props["osc-hazard:indicator_model_gcm"] != 'unknown' and props["osc-hazard:indicator_model_gcm"] != "{gcm}":
-            indicator_id = indicator_id + "_" + props["osc-hazard:indicator_model_gcm"]
-        
-        indicator_options.append(
+    props = data["properties"]
+    params = props["osc-hazard:params"]
+    # Values that do not change between parameter combinations
+    display_tmpl = props["osc-hazard:display_name"]
+    path_tmpl = props["osc-hazard:path"]
+    iid_tmpl = props["osc-hazard:indicator_id"].replace("/", "_")
+    model_id = props["osc-hazard:indicator_model_id"]
+    model_gcm = props["osc-hazard:indicator_model_gcm"]
+    iid_suffix = ""
+    if model_id:
+        iid_suffix += "_" + model_id.replace("/", "_")
+    if model_gcm not in ("unknown", "{gcm}"):
+        iid_suffix += "_" + model_gcm
+    # Parameters that are not part of the indicator id are left out of the label
+    display_tmpl_stripped = display_tmpl
+    for key in params:
+        if key not in props["osc-hazard:indicator_id"]:
+            display_tmpl_stripped = display_tmpl_stripped.replace("{" + key + "}", "")
+
+    # Without parameters there is a single option and the templates are used as is
+    if not params:
+        return [
             {
-                "label": display_name,
-                "value": indicator_id,
-                "path": path,
+                "label": display_tmpl,
+                "value": iid_tmpl.format() + iid_suffix,
+                "path": path_tmpl,
             }
-        )
+        ]
+
+    keys = list(params.keys())
+    indicator_options = [
+        {
+            "label": display_tmpl_stripped.format(**param_dict),
+            "value": iid_tmpl.format(**param_dict) + iid_suffix,
+            "path": path_tmpl.format_map(CustomDict(**param_dict)),
+        }
+        for values in itertools.product(*params.values())
+        for param_dict in (dict(zip(keys, values)),)
+    ]
     return dedupe_dict(indicator_options)
 
 
@@ -226,62 +352,131 @@ def dedupe_dict(dict_list: list[dict]) -> list[dict]:
     Returns:
     list[dict]: A list of dictionaries with duplicates removed.
     """
-    unique = []
+    unique = {}
     for item in dict_list:
-        if item not in unique:
-            unique.append(item)
-    return unique
+        key = tuple(sorted((k, _freeze(v)) for k, v in item.items()))
+        unique.setdefault(key, item)
+    return list(unique.values())
+
+
+def _freeze(value):
+    """
+    Converts a value into a hashable equivalent so it can be used as a dictionary key.
+
+    Parameters:
+    value: A value from an option dictionary.
+
+    Returns:
+    A hashable representation of the value.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
 
 
 def update_options(
     single_list: list[dict],
-    main_list: list[dict],
+    main_options: dict[str, dict],
     options_dicts: list[dict],
-):
+    seen: dict[tuple, set] | None = None,
+) -> dict[str, dict]:
     """
-    Updates the options of items in the main list with the options from the options
-    list. If an item from the single list does not exist in the main list, it is added
-    to the main list.
+    Updates the options of items in the main options with the options from the options
+    list. If an item from the single list does not exist in the main options, it is
+    added to the main options.
 
     Parameters:
     single_list (list): A list of dictionaries, each containing a 'label' key
     and an 'options' key.
-    main_list (list): A list of dictionaries, each containing a 'label' key
-    and an 'options' key.
+    main_options (dict): A dictionary of dictionaries keyed by their 'label', each
+    containing a 'label' key and an 'options' key.
     options_dicts (list): A list of dictionaries, each containing
     a 'name' key and a 'list' key.
-
+    seen (dict): The option values already merged into the main options, keyed by
+    label and option name. Pass the same dictionary for every call with the same
+    main options to avoid rebuilding it.
 
     Returns:
-    list: The updated main list.
+    dict[str, dict]: The updated main options, keyed by label.
     """
+    if seen is None:
+        seen = {}
     for single_item in single_list:
-        for main_item in main_list:
-            if main_item["label"] == single_item["label"]:
-                for option in options_dicts:
-                    options_name = option["name"]
-                    options_list = option["list"]
-                    if options_list != []:
-                        main_item[options_name] += [
-                            option["value"]
-                            for option in options_list
-                            if option["value"] not in main_item[options_name]
-                        ]
-                break
-        else:
-            if options_dicts != []:
-                for option in options_dicts:
-                    options_name = option["name"]
-                    options_list = option["list"]
-                    if options_list != []:
-                        single_item[options_name] = [
-                            option["value"] for option in options_list
-                        ]
-            main_list.append(single_item)
-    return main_list
+        main_item = main_options.get(single_item["label"])
+        if main_item is None:
+            for option in options_dicts:
+                options_name = option["name"]
+                options_list = option["list"]
+                if options_list != []:
+                    single_item[options_name] = list(
+                        dict.fromkeys(option["value"] for option in options_list)
+                    )
+            main_options[single_item["label"]] = single_item
+            continue
+        for option in options_dicts:
+            options_name = option["name"]
+            options_list = option["list"]
+            if options_list != []:
+                existing = main_item.setdefault(options_name, [])
+                key = (single_item["label"], options_name)
+                if key not in seen:
+                    seen[key] = set(existing)
+                for new_option in options_list:
+                    if new_option["value"] not in seen[key]:
+                        seen[key].add(new_option["value"])
+                        existing.append(new_option["value"])
+    return main_options
+
+
+def _merge_item(data: dict, accumulators: dict[str, dict], seen: dict[str, dict]):
+    """
+    Merges the menu options of a single item into the accumulated menu options.
+
+    Parameters:
+    data (dict): A dictionary containing properties and scenarios.
+    accumulators (dict): A dictionary of the accumulated options keyed by menu name,
+    each being a dictionary of options keyed by label.
+    seen (dict): A dictionary of the option values merged into each accumulator,
+    keyed by menu name, as used by update_options.
+    """
+    (
+        indicator_options,
+        climate_model_options,
+        scenario_options,
+        hazard_types,
+    ) = get_menu_items_from_file(data)
+    update_options(
+        hazard_types,
+        accumulators["hazardTypes"],
+        options_dicts=[{"name": "indicator_options", "list": indicator_options}],
+        seen=seen["hazardTypes"],
+    )
+    update_options(
+        indicator_options,
+        accumulators["indicatorOptions"],
+        options_dicts=[
+            {"name": "climate_model_options", "list": climate_model_options},
+            {"name": "scenario_options", "list": scenario_options},
+        ],
+        seen=seen["indicatorOptions"],
+    )
+    update_options(
+        climate_model_options,
+        accumulators["climateModelOptions"],
+        options_dicts=[{"name": "scenario_options", "list": scenario_options}],
+        seen=seen["climateModelOptions"],
+    )
+    update_options(
+        scenario_options,
+        accumulators["scenarioOptions"],
+        options_dicts=[],
+        seen=seen["scenarioOptions"],
+    )
 
 
-def create_menu_options(catalog_url: str) -> list[dict]:
+def create_menu_options(catalog_url: str) -> dict[str, list[dict]]:
     """
     This function generates menu options from the provided catalog URL.
 
@@ -289,54 +484,27 @@ def create_menu_options(catalog_url: str) -> list[dict]:
     catalog_url (str): A URL to a catalog.
 
     Returns:
-    list[dict]: A list of dictionaries containing menu options.
+    dict[str, list[dict]]: A dictionary of menu option lists keyed by menu name.
     """
-    indicator_options = []
-    climate_model_options = []
-    scenario_options = []
-    hazard_types = []
+    # Options are accumulated by label and only turned into lists at the end
+    accumulators = {
+        "climateModelOptions": {},
+        "scenarioOptions": {},
+        "indicatorOptions": {},
+        "hazardTypes": {},
+    }
+    seen = {name: {} for name in accumulators}
     item_links = get_item_links(catalog_url)
-    for item in item_links:
-        data = download_from_s3(item)
-        (
-            indicator_options_single,
-            climate_model_options_single,
-            scenario_options_single,
-            hazard_types_single,
-        ) = get_menu_items_from_file(data)
-        # Combine the lists
-        hazard_types = update_options(
-            hazard_types_single,
-            hazard_types,
-            options_dicts=[
-                {"name": "indicator_options", "list": indicator_options_single}
-            ],
-        )
-        indicator_options = update_options(
-            indicator_options_single,
-            indicator_options,
-            options_dicts=[
-                {"name": "climate_model_options", "list": climate_model_options_single},
-                {"name": "scenario_options", "list": scenario_options_single},
-            ],
-        )
-        climate_model_options = update_options(
-            climate_model_options_single,
-            climate_model_options,
-            options_dicts=[
-                {"name": "scenario_options", "list": scenario_options_single}
-            ],
-        )
-        scenario_options = update_options(
-            scenario_options_single, scenario_options, options_dicts=[]
-        )
+    # Download the item files concurrently and merge each one, in order, as it arrives
+    with ThreadPoolExecutor(
+        max_workers=max(1, min(MAX_DOWNLOAD_WORKERS, len(item_links)))
+    ) as executor:
+        for data in executor.map(download_from_s3, item_links):
+            _merge_item(data, accumulators, seen)
+    # Each file is only needed once, so don't keep the whole catalog in memory
+    _get_object_bytes.cache_clear()
 
-    return {
-        "climateModelOptions": climate_model_options,
-        "scenarioOptions": scenario_options,
-        "indicatorOptions": indicator_options,
-        "hazardTypes": hazard_types,
-    }
+    return {name: list(options.values()) for name, options in accumulators.items()}
 
 
 def create_menu_options_local(json_file: str) -> dict:
@@ -362,5 +530,13 @@ def save_menu_options_to_file(menu_options: dict, output_file: str):
     menu_options (dict): A dictionary containing menu options.
     output_file (str): The output file path.
     """
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(menu_options, f, ensure_ascii=False, indent=4)
+    if orjson is not None:
+        with open(output_file, "wb") as f:
+            f.write(
+                orjson.dumps(
+                    menu_options, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+                )
+            )
+    else:
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(menu_options, f, ensure_ascii=False, indent=2)
@@ -6,6 +6,11 @@ import os
 
 from hazard_options import create_menu_options, create_menu_options_local
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 def parse_arguments():
     """
@@ -44,7 +49,11 @@ if __name__ == "__main__":
     hazard_options = get_hazard_options(args.catalog_url)
     # Make a stac catalog.json file to satitsfy the process runner
     os.makedirs("asset_output", exist_ok=True)
-    with open("./asset_output/catalog.json", "w",encoding="utf8") as f:
-        catalog = get_catalog()
-        catalog["data"] = hazard_options
-        json.dump(catalog, f)
\ No newline at end of file
+    catalog = get_catalog()
+    catalog["data"] = hazard_options
+    if orjson is not None:
+        with open("./asset_output/catalog.json", "wb") as f:
+            f.write(orjson.dumps(catalog))
+    else:
+        with open("./asset_output/catalog.json", "w", encoding="utf8") as f:
+            json.dump(catalog, f)
\ No newline at end of file